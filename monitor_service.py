@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 import os
 import time
+import signal
 import logging
 import argparse
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 
 # Import our modules
 from wallet_monitor import WalletMonitor
-from notification_system import NotificationSystem
+from notification_system import NotificationSystem, BufferedNotifier
 
 # Set up logging
 logging.basicConfig(
@@ -24,6 +26,7 @@ def run_monitor(config_file="config.ini", once=False, interval=None):
     """Run the USG wallet monitor service"""
     monitor = WalletMonitor()
     notification_system = NotificationSystem(config_file)
+    buffered = BufferedNotifier(notification_system)
     
     # Get polling interval from config or command line
     if interval is None:
@@ -33,7 +36,25 @@ def run_monitor(config_file="config.ini", once=False, interval=None):
     
     logger.info(f"Starting USG wallet monitor service with polling interval of {interval} hours")
     
-    while True:
+    # Wake the sleep below as soon as systemd or the user asks us to stop
+    stop = threading.Event()
+    
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, exiting")
+        stop.set()
+        # A second Ctrl-C interrupts whatever the current check is blocked on
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    
+    signal.signal(signal.SIGTERM, request_stop)
+    
+    # A single run has no sleep to wake, so let Ctrl-C interrupt it straight away
+    if not once:
+        signal.signal(signal.SIGINT, request_stop)
+    
+    # Schedule checks from a monotonic deadline so run time doesn't shift the cadence
+    next_tick = time.monotonic()
+    
+    while not stop.is_set():
         try:
             # Run the monitor
             logger.info("Running wallet monitor check")
@@ -42,7 +63,11 @@ def run_monitor(config_file="config.ini", once=False, interval=None):
             # Send notifications if new wallets were found
             if new_wallets:
                 logger.info(f"Found {len(new_wallets)} new USG wallets, sending notifications")
-                notification_success = notification_system.send_notification(new_wallets)
+                notification_success = buffered.enqueue(new_wallets)
+                
+                # Don't hold alerts in the buffer across the polling sleep
+                if notification_success is None:
+                    notification_success = buffered.flush()
                 
                 if notification_success:
                     logger.info("Notifications sent successfully")
@@ -56,12 +81,15 @@ def run_monitor(config_file="config.ini", once=False, interval=None):
                 logger.info("Exiting after single run (--once flag specified)")
                 break
             
-            # Sleep until next check
-            next_check = datetime.now().timestamp() + (interval * 3600)
-            next_check_time = datetime.fromtimestamp(next_check).strftime('%Y-%m-%d %H:%M:%S')
+            # Sleep until next check, starting afresh if a long run or suspend overran it
+            next_tick += interval * 3600
+            if next_tick < time.monotonic():
+                next_tick = time.monotonic()
+            delay = max(0, next_tick - time.monotonic())
+            next_check_time = (datetime.now() + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
             logger.info(f"Next check scheduled for {next_check_time} (in {interval} hours)")
             
-            time.sleep(interval * 3600)
+            stop.wait(delay)
             
         except KeyboardInterrupt:
             logger.info("Received keyboard interrupt, exiting")
@@ -74,7 +102,7 @@ def run_monitor(config_file="config.ini", once=False, interval=None):
                 
             # Sleep for 5 minutes on error before retrying
             logger.info("Sleeping for 5 minutes before retrying")
-            time.sleep(300)
+            stop.wait(300)
 
 def main():
     """Main entry point with command line argument parsing"""
@@ -1,12 +1,11 @@
-import requests
-import json
+import asyncio
+import time
+import orjson
 import logging
 from datetime import datetime
 import os
+import re
 import configparser
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 # Set up logging
 logging.basicConfig(
@@ -19,6 +18,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger("usg_notification_system")
 
+# Markdown patterns converted for the HTML email body
+_BOLD_RE = re.compile(r'\*\*(.+?)\*\*', re.DOTALL)
+_CODE_RE = re.compile(r'`([^`]+)`')
+
+# Discord webhooks accept at most 10 embeds per message
+_DISCORD_MAX_EMBEDS = 10
+
+# Telegram caps messages at 4096 characters
+_TELEGRAM_MAX_LENGTH = 4000
+
+# Retry policy for webhook and bot API posts
+_MAX_RETRIES = 3
+_RETRY_BACKOFF = 0.5
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest server-requested wait we'll sit through; the check loop can't be interrupted meanwhile
+_MAX_RETRY_DELAY = 30
+
 class Config:
     """Configuration manager for the Notification System"""
     
@@ -67,14 +84,113 @@ class Config:
         return self.config.getint(section, key, fallback=fallback)
 
 
+class TokenBucket:
+    """Token bucket rate limiter for async senders"""
+    
+    def __init__(self, rate=1.0, capacity=5):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+    
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        
+        # Take the token up front, going into debt if needed, so concurrent callers queue in order
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
 class NotificationSystem:
     """Notification system for the USG Wallet Monitor"""
     
     def __init__(self, config_file="config.ini"):
         self.config = Config(config_file)
+        self._session = None
+        self._telegram_buckets = {}
+    
+    async def _get_session(self):
+        """Get the shared HTTP session, creating it on first use"""
+        import aiohttp
+        
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, limit_per_host=10),
+                timeout=aiohttp.ClientTimeout(total=10),
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
+        return self._session
+    
+    async def _post(self, url, **kwargs):
+        """POST through the shared session, retrying rate limits and server errors"""
+        import aiohttp
+        
+        session = await self._get_session()
+        
+        for attempt in range(_MAX_RETRIES + 1):
+            try:
+                async with session.post(url, **kwargs) as response:
+                    body = await response.text()
+                    if response.status not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+                        return response.status, body
+                    delay = self._retry_delay(response, body, attempt)
+                    if delay > _MAX_RETRY_DELAY:
+                        logger.error(
+                            f"Server asked to retry in {delay:.0f}s (limit {_MAX_RETRY_DELAY}s), "
+                            f"dropping notification after HTTP {response.status}"
+                        )
+                        return response.status, body
+                    reason = f"HTTP {response.status}"
+            except aiohttp.ClientConnectionError as e:
+                if attempt == _MAX_RETRIES:
+                    raise
+                delay = _RETRY_BACKOFF * (2 ** attempt)
+                reason = str(e)
+            
+            logger.warning(f"Request failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    def _retry_delay(self, response, body, attempt):
+        """Seconds to wait before retrying, preferring the delay the server asks for"""
+        # Retry-After is standard; Discord also sends X-RateLimit-Reset-After
+        for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+            try:
+                return float(response.headers[header])
+            except (KeyError, ValueError):
+                pass
+        
+        # Telegram reports the wait in the JSON body as parameters.retry_after
+        try:
+            retry_after = orjson.loads(body).get('parameters', {}).get('retry_after')
+            if isinstance(retry_after, (int, float)):
+                return float(retry_after)
+        except (ValueError, AttributeError):
+            pass
+        
+        return _RETRY_BACKOFF * (2 ** attempt)
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     def send_notification(self, wallets):
         """Send notifications about new wallets through configured channels"""
+        async def _send():
+            try:
+                return await self.send_notification_async(wallets)
+            finally:
+                await self.close()
+        
+        return asyncio.run(_send())
+    
+    async def send_notification_async(self, wallets):
+        """Send notifications about new wallets through all enabled channels concurrently"""
         if not wallets:
             logger.info("No new wallets to notify about")
             return
@@ -82,20 +198,26 @@ class NotificationSystem:
         # Create notification message
         message = self._create_message(wallets)
         
-        # Send through each enabled channel
-        success = False
+        # Launch each enabled channel at once so latency is the slowest channel, not the sum
+        tasks = []
         
         if self.config.getboolean("NOTIFICATION", "discord_enabled", fallback=True):
-            discord_success = self._send_discord(message, wallets)
-            success = success or discord_success
+            tasks.append(self._send_discord(message, wallets))
         
         if self.config.getboolean("NOTIFICATION", "enable_email", fallback=False):
-            email_success = self._send_email(message, wallets)
-            success = success or email_success
+            tasks.append(self._send_email(message, wallets))
             
         if self.config.getboolean("NOTIFICATION", "telegram_enabled", fallback=False):
-            telegram_success = self._send_telegram(message, wallets)
-            success = success or telegram_success
+            tasks.append(self._send_telegram(message, wallets))
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        success = False
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Notification channel failed: {result}")
+            else:
+                success = success or result
         
         return success
     
@@ -103,28 +225,25 @@ class NotificationSystem:
         """Create a notification message for the new wallets"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        message = f"🚨 **NEW USG WALLET ALERT** 🚨\n\n"
-        message += f"Detected {len(wallets)} new USG wallet(s) at {timestamp}\n\n"
+        parts = [f"🚨 **NEW USG WALLET ALERT** 🚨\n\nDetected {len(wallets)} new USG wallet(s) at {timestamp}\n\n"]
         
         for i, wallet in enumerate(wallets, 1):
-            message += f"**Wallet #{i}**\n"
-            message += f"• Address: `{wallet['address']}`\n"
-            message += f"• Chain: {wallet['chain']}\n"
+            parts.append(f"**Wallet #{i}**\n• Address: `{wallet['address']}`\n• Chain: {wallet['chain']}\n")
             
             if wallet.get('first_transaction'):
-                message += f"• First Transaction: {wallet['first_transaction']}\n"
+                parts.append(f"• First Transaction: {wallet['first_transaction']}\n")
             
             if wallet.get('label'):
-                message += f"• Label: {wallet['label']}\n"
+                parts.append(f"• Label: {wallet['label']}\n")
             
             if wallet.get('balance') is not None:
-                message += f"• Balance: {wallet['balance']}\n"
+                parts.append(f"• Balance: {wallet['balance']}\n")
             
-            message += f"• Link: https://intel.arkm.com/explorer/address/{wallet['address']}\n\n"
+            parts.append(f"• Link: https://intel.arkm.com/explorer/address/{wallet['address']}\n\n")
         
-        return message
+        return ''.join(parts)
     
-    def _send_discord(self, message, wallets):
+    async def _send_discord(self, message, wallets):
         """Send notification to Discord webhook"""
         webhook_url = self.config.get("NOTIFICATION", "discord_webhook")
         
@@ -133,31 +252,64 @@ class NotificationSystem:
             return False
         
         try:
-            payload = {
-                "content": message,
-                "username": "USG Wallet Monitor",
-                "avatar_url": "https://cryptologos.cc/logos/usd-coin-usdc-logo.png"
-            }
+            embeds = [self._create_discord_embed(i, wallet) for i, wallet in enumerate(wallets, 1)]
             
-            response = requests.post(
-                webhook_url,
-                data=json.dumps(payload),
-                headers={"Content-Type": "application/json"}
-            )
+            # Pack the wallet embeds into as few webhook posts as Discord allows
+            for start in range(0, len(embeds), _DISCORD_MAX_EMBEDS):
+                payload = {
+                    "username": "USG Wallet Monitor",
+                    "avatar_url": "https://cryptologos.cc/logos/usd-coin-usdc-logo.png",
+                    "embeds": embeds[start:start + _DISCORD_MAX_EMBEDS]
+                }
+                
+                if start == 0:
+                    payload["content"] = f"🚨 **NEW USG WALLET ALERT** 🚨\nDetected {len(wallets)} new USG wallet(s)"
+                
+                status, body = await self._post(webhook_url, json=payload)
+                
+                if status != 204:
+                    logger.error(f"Failed to send Discord notification: {status} {body}")
+                    return False
             
-            if response.status_code == 204:
-                logger.info("Discord notification sent successfully")
-                return True
-            else:
-                logger.error(f"Failed to send Discord notification: {response.status_code} {response.text}")
-                return False
+            logger.info("Discord notification sent successfully")
+            return True
                 
         except Exception as e:
             logger.error(f"Error sending Discord notification: {e}")
             return False
     
-    def _send_email(self, message, wallets):
+    def _create_discord_embed(self, index, wallet):
+        """Create a Discord embed describing a single wallet"""
+        description = f"**Chain:** {wallet['chain']}"
+        
+        if wallet.get('first_transaction'):
+            description += f"\n**First Transaction:** {wallet['first_transaction']}"
+        
+        if wallet.get('label'):
+            description += f"\n**Label:** {wallet['label']}"
+        
+        if wallet.get('balance') is not None:
+            description += f"\n**Balance:** {wallet['balance']}"
+        
+        embed = {
+            "title": f"New USG Wallet #{index}",
+            "description": description,
+            "url": f"https://intel.arkm.com/explorer/address/{wallet['address']}",
+            "fields": [{"name": "Address", "value": f"`{wallet['address']}`", "inline": False}]
+        }
+        
+        if wallet.get('first_seen'):
+            embed["timestamp"] = wallet['first_seen']
+        
+        return embed
+    
+    async def _send_email(self, message, wallets):
         """Send notification via email"""
+        # Only pay for the SMTP and MIME imports when email is actually sent
+        import aiosmtplib
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
         smtp_server = self.config.get("NOTIFICATION", "smtp_server")
         smtp_port = self.config.getint("NOTIFICATION", "smtp_port", fallback=587)
         smtp_username = self.config.get("NOTIFICATION", "smtp_username")
@@ -184,24 +336,22 @@ class NotificationSystem:
             
             # Convert Discord-style message to HTML
             html_message = message.replace("\n", "<br>")
-            html_message = html_message.replace("**", "<strong>", 1)
-            html_message = html_message.replace("**", "</strong>", 1)
-            html_message = html_message.replace("**", "<strong>")
-            html_message = html_message.replace("**", "</strong>")
-            html_message = html_message.replace("`", "<code>", 1)
-            html_message = html_message.replace("`", "</code>", 1)
-            html_message = html_message.replace("`", "<code>")
-            html_message = html_message.replace("`", "</code>")
+            html_message = _BOLD_RE.sub(r'<strong>\1</strong>', html_message)
+            html_message = _CODE_RE.sub(r'<code>\1</code>', html_message)
             
             # Attach HTML and plain text versions
             msg.attach(MIMEText(message, 'plain'))
             msg.attach(MIMEText(html_message, 'html'))
             
             # Send email
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(smtp_username, smtp_password)
-                server.send_message(msg)
+            await aiosmtplib.send(
+                msg,
+                hostname=smtp_server,
+                port=smtp_port,
+                start_tls=True,
+                username=smtp_username,
+                password=smtp_password
+            )
             
             logger.info(f"Email notification sent to {len(recipients)} recipients")
             return True
@@ -210,7 +360,7 @@ class NotificationSystem:
             logger.error(f"Error sending email notification: {e}")
             return False
     
-    def _send_telegram(self, message, wallets):
+    async def _send_telegram(self, message, wallets):
         """Send notification via Telegram"""
         bot_token = self.config.get("NOTIFICATION", "telegram_bot_token")
         chat_id = self.config.get("NOTIFICATION", "telegram_chat_id")
@@ -222,24 +372,114 @@ class NotificationSystem:
         try:
             url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
             
-            payload = {
-                "chat_id": chat_id,
-                "text": message,
-                "parse_mode": "Markdown"
-            }
+            # Stay under Telegram's per-chat limit instead of waiting to be told off with a 429
+            bucket = self._telegram_buckets.setdefault(chat_id, TokenBucket(rate=1.0, capacity=5))
             
-            response = requests.post(url, data=payload)
+            # Long alerts go out as consecutive messages, split between wallets
+            for text in self._split_telegram_message(message):
+                payload = {
+                    "chat_id": chat_id,
+                    "text": text,
+                    "parse_mode": "Markdown"
+                }
+                
+                await bucket.acquire()
+                status, body = await self._post(url, json=payload)
+                
+                if status != 200:
+                    logger.error(f"Failed to send Telegram notification: {status} {body}")
+                    return False
             
-            if response.status_code == 200:
-                logger.info("Telegram notification sent successfully")
-                return True
-            else:
-                logger.error(f"Failed to send Telegram notification: {response.status_code} {response.text}")
-                return False
+            logger.info("Telegram notification sent successfully")
+            return True
                 
         except Exception as e:
             logger.error(f"Error sending Telegram notification: {e}")
             return False
+    
+    def _split_telegram_message(self, message):
+        """Split a message into pieces under Telegram's length limit, breaking between paragraphs"""
+        if len(message) <= _TELEGRAM_MAX_LENGTH:
+            return [message]
+        
+        pieces = []
+        current = ""
+        
+        # Paragraphs hold whole wallet entries, so Markdown is never cut mid-entity
+        for paragraph in message.split("\n\n"):
+            if current and len(current) + 2 + len(paragraph) > _TELEGRAM_MAX_LENGTH:
+                pieces.append(current)
+                current = ""
+            
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+            
+            # A single oversized paragraph has to be cut wherever it fits
+            while len(current) > _TELEGRAM_MAX_LENGTH:
+                pieces.append(current[:_TELEGRAM_MAX_LENGTH])
+                current = current[_TELEGRAM_MAX_LENGTH:]
+        
+        if current:
+            pieces.append(current)
+        
+        return pieces
+
+
+class BufferedNotifier:
+    """Coalesces new wallets into batched notifications"""
+    
+    MAX_BATCH = 50
+    FLUSH_INTERVAL = 3.0
+    
+    def __init__(self, notification_system):
+        self.notification_system = notification_system
+        self._buffer = []
+        self._last_flush = time.monotonic()
+    
+    @property
+    def pending(self):
+        """Number of wallets waiting to be sent"""
+        return len(self._buffer)
+    
+    def enqueue(self, wallets):
+        """Queue wallets for notification, flushing if the batch is due"""
+        now = datetime.now()
+        self._buffer.extend((now, wallet) for wallet in wallets)
+        return self._maybe_flush()
+    
+    def _maybe_flush(self):
+        """Flush when the buffer is full or the flush interval has elapsed"""
+        if not self._buffer:
+            return None
+        
+        if len(self._buffer) >= self.MAX_BATCH or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            return self.flush()
+        
+        return None
+    
+    def flush(self):
+        """Send all buffered wallets"""
+        async def _flush():
+            try:
+                return await self.flush_async()
+            finally:
+                await self.notification_system.close()
+        
+        return asyncio.run(_flush())
+    
+    async def flush_async(self):
+        """Send all buffered wallets as a single alert"""
+        wallets = [wallet for _, wallet in self._buffer]
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        
+        if not wallets:
+            return None
+        
+        # Each channel fits the alert to its own limits, so send it whole
+        success = await self.notification_system.send_notification_async(wallets)
+        
+        logger.info(f"Flushed {len(wallets)} wallet(s) in one notification")
+        return bool(success)
 
 
 def main():
@@ -1,13 +1,12 @@
-import requests
 import sqlite3
-import json
+import orjson
 import time
 import logging
 from datetime import datetime
 import os
 import configparser
+import hashlib
 import re
-from bs4 import BeautifulSoup
 
 # Set up logging
 logging.basicConfig(
@@ -20,6 +19,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger("usg_wallet_monitor")
 
+# Patterns used when scraping the entity page
+_STREAM_TAGS = ('a', 'div', 'script')
+_CHAIN_RE = re.compile(r'(ETH|BTC|USDT|SOL)', re.IGNORECASE)
+_BALANCE_RE = re.compile(r'\$([\d,.]+)')
+_SCRIPT_ADDR_RE = re.compile(r'"address":"([^"]+)"')
+# (connect, read) seconds, so a stalled Arkham request can't block shutdown
+_REQUEST_TIMEOUT = (10, 30)
+
+
+def _json_dumps(obj):
+    """Serialise an object to a JSON string for storage in a TEXT column"""
+    return orjson.dumps(obj).decode()
+
+
+def _history_endpoint(entity_id):
+    """Endpoint key under which entity history responses are stored"""
+    return f"/history/entity/{entity_id}"
+
+
+def _is_card_class(css_class):
+    """Match wallet card containers by class name"""
+    return css_class is not None and 'card' in css_class
+
+
+def _drop_preceding(element):
+    """Delete the finished siblings before an element and before each of its ancestors"""
+    for node in (element, *element.iterancestors()):
+        parent = node.getparent()
+        while node.getprevious() is not None:
+            del parent[0]
+
+
+def _walk_for_wallets(data):
+    """Yield every object in a JSON document that carries an address, in document order"""
+    stack = [data]
+    
+    while stack:
+        node = stack.pop()
+        
+        if isinstance(node, dict):
+            if isinstance(node.get('address'), str):
+                yield node
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+
 class Config:
     """Configuration manager for the USG Wallet Monitor"""
     
@@ -85,8 +131,16 @@ class Database:
     def _connect(self):
         """Connect to the SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_file)
+            # A larger statement cache lets the repeated queries below skip re-parsing
+            self.conn = sqlite3.connect(self.db_file, cached_statements=256)
             self.conn.row_factory = sqlite3.Row
+            self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-20000;
+            PRAGMA mmap_size=268435456;
+            """)
             logger.info(f"Connected to database: {self.db_file}")
         except sqlite3.Error as e:
             logger.error(f"Database connection error: {e}")
@@ -95,55 +149,71 @@ class Database:
     def _create_tables(self):
         """Create necessary tables if they don't exist"""
         try:
-            cursor = self.conn.cursor()
-            
-            # Table for storing wallet addresses
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS wallets (
-                address TEXT PRIMARY KEY,
-                chain TEXT NOT NULL,
-                first_seen TEXT NOT NULL,
-                first_transaction TEXT,
-                label TEXT,
-                balance REAL,
-                raw_data TEXT
-            )
-            ''')
+            with self.conn:
+                # Table for storing wallet addresses
+                self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS wallets (
+                    address TEXT PRIMARY KEY,
+                    chain TEXT NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    first_transaction TEXT,
+                    label TEXT,
+                    balance REAL,
+                    raw_data TEXT
+                )
+                ''')
+                
+                # Table for storing API responses
+                self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS api_responses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    endpoint TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    content_hash TEXT
+                )
+                ''')
+                self._ensure_column("api_responses", "content_hash", "TEXT")
+                
+                # Table for storing HTTP cache validators per scraped URL
+                self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    timestamp TEXT NOT NULL
+                )
+                ''')
             
-            # Table for storing API responses
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_responses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                endpoint TEXT NOT NULL,
-                response TEXT NOT NULL,
-                timestamp TEXT NOT NULL
-            )
-            ''')
-            
-            self.conn.commit()
             logger.info("Database tables created/verified")
         except sqlite3.Error as e:
             logger.error(f"Database table creation error: {e}")
             raise
     
+    def _ensure_column(self, table, column, definition):
+        """Add a column to a table created by an older version of the monitor"""
+        columns = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info(f"Added column {column} to table {table}")
+    
     def close(self):
         """Close the database connection"""
         if self.conn:
             self.conn.close()
             logger.info("Database connection closed")
     
-    def save_api_response(self, endpoint, response):
+    def save_api_response(self, endpoint, response, content_hash=None):
         """Save an API response to the database"""
         try:
-            cursor = self.conn.cursor()
             timestamp = datetime.now().isoformat()
             
-            cursor.execute(
-                "INSERT INTO api_responses (endpoint, response, timestamp) VALUES (?, ?, ?)",
-                (endpoint, json.dumps(response), timestamp)
-            )
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO api_responses (endpoint, response, timestamp, content_hash) VALUES (?, ?, ?, ?)",
+                    (endpoint, _json_dumps(response), timestamp, content_hash)
+                )
             
-            self.conn.commit()
             logger.info(f"Saved API response for endpoint: {endpoint}")
             return cursor.lastrowid
         except sqlite3.Error as e:
@@ -153,80 +223,380 @@ class Database:
     def get_latest_api_response(self, endpoint):
         """Get the latest API response for a specific endpoint"""
         try:
-            cursor = self.conn.cursor()
-            
-            cursor.execute(
+            row = self.conn.execute(
                 "SELECT response FROM api_responses WHERE endpoint = ? ORDER BY id DESC LIMIT 1",
                 (endpoint,)
-            )
+            ).fetchone()
             
-            row = cursor.fetchone()
             if row:
-                return json.loads(row['response'])
+                return orjson.loads(row['response'])
             return None
         except sqlite3.Error as e:
             logger.error(f"Error retrieving API response: {e}")
             raise
     
+    def get_latest_content_hash(self, endpoint):
+        """Get the content hash of the latest API response for a specific endpoint"""
+        try:
+            row = self.conn.execute(
+                "SELECT content_hash FROM api_responses WHERE endpoint = ? ORDER BY id DESC LIMIT 1",
+                (endpoint,)
+            ).fetchone()
+            
+            if row:
+                return row['content_hash']
+            return None
+        except sqlite3.Error as e:
+            logger.error(f"Error retrieving content hash: {e}")
+            raise
+    
+    def get_http_validators(self, url):
+        """Get the stored ETag and Last-Modified values for a URL"""
+        try:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM http_cache WHERE url = ?",
+                (url,)
+            ).fetchone()
+            
+            if row:
+                return row['etag'], row['last_modified']
+            return None, None
+        except sqlite3.Error as e:
+            logger.error(f"Error retrieving HTTP cache validators: {e}")
+            raise
+    
+    def save_http_validators(self, url, etag, last_modified):
+        """Save the ETag and Last-Modified values for a URL"""
+        try:
+            timestamp = datetime.now().isoformat()
+            
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, timestamp) VALUES (?, ?, ?, ?)",
+                    (url, etag, last_modified, timestamp)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error saving HTTP cache validators: {e}")
+            raise
+    
     def get_known_wallet_addresses(self):
         """Get a list of all known wallet addresses"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT address FROM wallets")
-            
-            return [row['address'] for row in cursor.fetchall()]
+            return [row['address'] for row in self.conn.execute("SELECT address FROM wallets")]
         except sqlite3.Error as e:
             logger.error(f"Error retrieving wallet addresses: {e}")
             raise
     
+    def get_new_wallet_addresses(self, addresses):
+        """Get the subset of the given addresses that aren't in the database yet"""
+        try:
+            with self.conn:
+                # Stage the candidates so SQLite can diff them against the primary key index
+                self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS candidate_addresses (address TEXT PRIMARY KEY)")
+                self.conn.execute("DELETE FROM candidate_addresses")
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO candidate_addresses (address) VALUES (?)",
+                    ((address,) for address in addresses)
+                )
+                
+                rows = self.conn.execute(
+                    "SELECT address FROM candidate_addresses EXCEPT SELECT address FROM wallets"
+                )
+                return {row['address'] for row in rows}
+        except sqlite3.Error as e:
+            logger.error(f"Error diffing wallet addresses: {e}")
+            raise
+    
     def save_wallet(self, address, chain, first_seen, first_transaction=None, label=None, balance=None, raw_data=None):
         """Save a wallet to the database"""
         try:
-            cursor = self.conn.cursor()
-            
-            cursor.execute(
-                """
-                INSERT OR REPLACE INTO wallets 
-                (address, chain, first_seen, first_transaction, label, balance, raw_data) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (address, chain, first_seen, first_transaction, label, balance, 
-                 json.dumps(raw_data) if raw_data else None)
-            )
+            with self.conn:
+                cursor = self.conn.execute(
+                    """
+                    INSERT OR REPLACE INTO wallets 
+                    (address, chain, first_seen, first_transaction, label, balance, raw_data) 
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (address, chain, first_seen, first_transaction, label, balance, 
+                     _json_dumps(raw_data) if raw_data else None)
+                )
             
-            self.conn.commit()
             logger.info(f"Saved wallet: {address}")
             return cursor.lastrowid
         except sqlite3.Error as e:
             logger.error(f"Error saving wallet: {e}")
             raise
+    
+    def save_wallets_bulk(self, wallets):
+        """Save several wallets to the database in a single transaction"""
+        try:
+            rows = [
+                (wallet['address'], wallet.get('chain', 'unknown'),
+                 wallet.get('first_seen', datetime.now().isoformat()),
+                 wallet.get('first_transaction'), wallet.get('label', 'USG Wallet'),
+                 wallet.get('balance', 0), _json_dumps(wallet))
+                for wallet in wallets
+            ]
+            
+            with self.conn:
+                self.conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO wallets 
+                    (address, chain, first_seen, first_transaction, label, balance, raw_data) 
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows
+                )
+            
+            logger.info(f"Saved {len(rows)} wallets")
+            return len(rows)
+        except sqlite3.Error as e:
+            logger.error(f"Error saving wallets: {e}")
+            raise
+
+
+class _WalletExtractor:
+    """Incrementally extracts wallets from entity page HTML as it is downloaded"""
+    
+    def __init__(self, encoding=None):
+        from lxml import etree
+        
+        self._parser = etree.HTMLPullParser(events=('end',), tag=_STREAM_TAGS, encoding=encoding)
+        self._first_seen = datetime.now().isoformat()
+        self._next_data = None
+        self._script_addresses = []
+        self.wallets = []
+        self._seen_addresses = set()
+    
+    def feed(self, chunk):
+        """Parse the next chunk of the page"""
+        self._parser.feed(chunk)
+        self._handle_events()
+    
+    def close(self):
+        """Finish parsing and return the extracted wallets"""
+        from lxml import etree
+        
+        try:
+            self._parser.close()
+        except etree.LxmlError as e:
+            # An empty or unreadable body simply has no wallets in it
+            logger.warning(f"Could not finish parsing entity page: {e}")
+        self._handle_events()
+        
+        # Prefer the page state embedded as JSON, which also carries chain and balance data
+        if self._next_data is not None:
+            link_wallets, link_addresses = self.wallets, self._seen_addresses
+            self.wallets, self._seen_addresses = [], set()
+            
+            for node in _walk_for_wallets(self._next_data):
+                chain = node.get('chain')
+                balance = node.get('balance')
+                label = node.get('label')
+                
+                self._add_wallet(
+                    node['address'],
+                    chain=chain if isinstance(chain, str) else "unknown",
+                    balance=balance if isinstance(balance, (int, float)) else 0,
+                    label=label if isinstance(label, str) else "USG Wallet"
+                )
+            
+            # Page state without wallet records (e.g. fetched client-side) says nothing about the links
+            if not self.wallets:
+                self.wallets, self._seen_addresses = link_wallets, link_addresses
+        
+        # As a last resort, pick addresses out of inline script data
+        if not self.wallets:
+            for address in self._script_addresses:
+                self._add_wallet(address)
+        
+        logger.info(f"Extracted {len(self.wallets)} wallets from page")
+        return self.wallets
+    
+    def _add_wallet(self, address, chain="unknown", balance=0, label="USG Wallet"):
+        """Record a wallet, skipping addresses already seen on this page"""
+        if address in self._seen_addresses:
+            return
+        
+        self._seen_addresses.add(address)
+        self.wallets.append({
+            "address": address,
+            "chain": chain,
+            "balance": balance,
+            "label": label,
+            "first_seen": self._first_seen,
+            "first_transaction": None
+        })
+    
+    def _handle_events(self):
+        """Process the elements completed by the last chunk"""
+        for _, element in self._parser.read_events():
+            # Page state can sit anywhere, including inside a card, so read scripts straight away
+            if element.tag == 'script':
+                self._handle_script(element)
+                element.clear(keep_tail=True)
+                continue
+            
+            is_card = element.tag == 'div' and _is_card_class(element.get('class'))
+            
+            # Text inside a card is still needed until the card itself is complete
+            if not is_card and any(_is_card_class(div.get('class')) for div in element.iterancestors('div')):
+                continue
+            
+            if element.tag == 'a':
+                address = self._address_from_link(element)
+                if address:
+                    self._add_wallet(address)
+            elif is_card:
+                self._handle_card(element)
+            
+            # Release the finished subtree and everything parsed before it, so the
+            # tree only ever holds the elements still open plus the current card
+            element.clear(keep_tail=True)
+            _drop_preceding(element)
+    
+    def _handle_script(self, element):
+        """Load the __NEXT_DATA__ JSON state blob, or note addresses in other inline data"""
+        if not element.text:
+            return
+        
+        if element.get('id') != '__NEXT_DATA__':
+            if 'wallets' in element.text:
+                self._script_addresses.extend(_SCRIPT_ADDR_RE.findall(element.text))
+            return
+        
+        try:
+            self._next_data = orjson.loads(element.text)
+        except ValueError as e:
+            logger.warning(f"Could not parse __NEXT_DATA__ JSON: {e}")
+    
+    def _handle_card(self, card):
+        """Extract the wallets in a card, with the chain and balance shown alongside them"""
+        chain = "unknown"
+        balance = 0
+        
+        # Try to extract chain information
+        chain_match = next(filter(None, map(_CHAIN_RE.search, card.itertext())), None)
+        if chain_match:
+            chain = chain_match.group(0).upper()
+        
+        # Try to extract balance information
+        balance_match = next(filter(None, map(_BALANCE_RE.search, card.itertext())), None)
+        if balance_match:
+            try:
+                balance = float(balance_match.group(1).replace(',', ''))
+            except ValueError:
+                balance = 0
+        
+        for link in card.iter('a'):
+            address = self._address_from_link(link)
+            if address:
+                self._add_wallet(address, chain=chain, balance=balance)
+    
+    def _address_from_link(self, link):
+        """Get the wallet address an explorer link points to, if it is one"""
+        href = link.get('href') or ''
+        
+        if '/explorer/address/' not in href:
+            return None
+        return href.split('/explorer/address/')[-1]
 
 
 class ArkhamAPI:
     """Interface for the Arkham Intelligence API using web scraping for unofficial access"""
     
-    def __init__(self, config):
+    def __init__(self, config, db=None):
+        # HTTP and parsing libraries are imported on first use to keep startup light
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
         self.config = config
+        self.db = db
         self.base_url = config.get("API", "base_url")
+        self.not_modified = False
+        self.content_hash = None
+        self._last_history = None
+        self._pending_validators = None
+        self._pending_page = None
         self.session = requests.Session()
+        
+        # Pool connections and retry transient failures and rate limiting
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                respect_retry_after_header=True
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         })
     
     def get_entity_history(self, entity_id):
         """Get history for a specific entity using web scraping"""
+        import requests
+        
         url = f"{self.base_url}/explorer/entity/{entity_id}"
         
+        self.not_modified = False
+        self._pending_validators = None
+        self._pending_page = None
+        
         try:
             logger.info(f"Scraping entity history for: {entity_id}")
-            response = self.session.get(url)
-            response.raise_for_status()
+            response = self.session.get(
+                url, headers=self._conditional_headers(url), stream=True, timeout=_REQUEST_TIMEOUT
+            )
             
-            # Parse the HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
+            if response.status_code == 304:
+                response.close()
+                cached_data = self._cached_history(entity_id)
+                if cached_data is not None:
+                    logger.info(f"Entity page not modified since last check: {entity_id}")
+                    self.not_modified = True
+                    return cached_data
+                
+                # Nothing stored to fall back on, so fetch the full page
+                response = self.session.get(url, stream=True, timeout=_REQUEST_TIMEOUT)
             
-            # Extract wallet data from the page
-            wallets = self._extract_wallets_from_page(soup)
+            with response:
+                response.raise_for_status()
+                
+                # Held back until the wallets are stored, so a failed cycle isn't answered with a 304 next time
+                self._pending_validators = (url, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                
+                # Only trust the declared charset; otherwise let lxml read it from the page
+                content_type = response.headers.get('Content-Type', '').lower()
+                encoding = response.encoding if 'charset' in content_type else None
+                try:
+                    extractor = _WalletExtractor(encoding)
+                except LookupError:
+                    # lxml doesn't know this charset, so let it sniff the document instead
+                    logger.warning(f"Unsupported charset {encoding!r} for {url}, detecting encoding from content")
+                    extractor = _WalletExtractor(None)
+                digest = hashlib.sha256()
+                
+                # Hash and parse the page as it downloads, without holding the whole body in memory
+                for chunk in response.iter_content(65536):
+                    digest.update(chunk)
+                    extractor.feed(chunk)
+                
+                wallets = extractor.close()
+            
+            # Identical page bytes mean identical wallets, so skip storing and diffing them
+            content_hash = digest.hexdigest()
+            if content_hash == self._stored_content_hash(entity_id):
+                cached_data = self._cached_history(entity_id)
+                if cached_data is not None:
+                    logger.info(f"Entity page content unchanged since last check: {entity_id}")
+                    self.not_modified = True
+                    return cached_data
             
             # Create a structured response similar to what an API might return
             history_data = {
@@ -237,98 +607,51 @@ class ArkhamAPI:
                 }
             }
             
+            # Only remembered as processed once the caller has stored the wallets
+            self._pending_page = (content_hash, history_data)
+            
             return history_data
         except requests.exceptions.RequestException as e:
             logger.error(f"Web scraping error: {e}")
             return None
     
-    def get_entity_portfolio(self, entity_id):
-        """Get portfolio data for a specific entity using web scraping"""
-        # For simplicity, we'll use the same data as history since we're scraping
-        # In a real implementation, you might want to scrape a different page or section
-        return self.get_entity_history(entity_id)
+    def mark_processed(self):
+        """Persist the state of the last fetched page once its wallets have been stored"""
+        if self._pending_page is not None:
+            self.content_hash, self._last_history = self._pending_page
+        
+        if self._pending_validators is not None and self.db is not None:
+            self.db.save_http_validators(*self._pending_validators)
+        
+        self._pending_validators = None
+        self._pending_page = None
     
-    def _extract_wallets_from_page(self, soup):
-        """Extract wallet information from the BeautifulSoup object"""
-        wallets = []
+    def _stored_content_hash(self, entity_id):
+        """Get the hash of the last parsed page, loading it from the database after a restart"""
+        if self.content_hash is None and self.db is not None:
+            self.content_hash = self.db.get_latest_content_hash(_history_endpoint(entity_id))
+        return self.content_hash
+    
+    def _cached_history(self, entity_id):
+        """Get the last parsed history, loading it from the database after a restart"""
+        if self._last_history is None and self.db is not None:
+            self._last_history = self.db.get_latest_api_response(_history_endpoint(entity_id))
+        return self._last_history
+    
+    def _conditional_headers(self, url):
+        """Build If-None-Match/If-Modified-Since headers from the stored validators"""
+        if self.db is None:
+            return {}
         
-        # Look for wallet addresses in the page
-        # This is a simplified approach - in production, you'd need more robust parsing
-        wallet_elements = soup.find_all('a', href=re.compile(r'/explorer/address/'))
+        etag, last_modified = self.db.get_http_validators(url)
+        headers = {}
         
-        for element in wallet_elements:
-            address = element.get('href').split('/explorer/address/')[-1]
-            
-            # Get additional data if available
-            parent_div = element.find_parent('div', class_=re.compile(r'.*card.*'))
-            
-            chain = "unknown"
-            balance = 0
-            label = "USG Wallet"
-            
-            # Try to extract chain information
-            chain_element = None
-            if parent_div:
-                chain_element = parent_div.find(string=re.compile(r'(ETH|BTC|USDT|SOL)', re.IGNORECASE))
-            
-            if chain_element:
-                chain_match = re.search(r'(ETH|BTC|USDT|SOL)', chain_element, re.IGNORECASE)
-                if chain_match:
-                    chain = chain_match.group(0).upper()
-            
-            # Try to extract balance information
-            balance_element = None
-            if parent_div:
-                balance_element = parent_div.find(string=re.compile(r'\$[\d,.]+'))
-            
-            if balance_element:
-                balance_match = re.search(r'\$([\d,.]+)', balance_element)
-                if balance_match:
-                    try:
-                        balance = float(balance_match.group(1).replace(',', ''))
-                    except ValueError:
-                        balance = 0
-            
-            # Create wallet object
-            wallet = {
-                "address": address,
-                "chain": chain,
-                "balance": balance,
-                "label": label,
-                "first_seen": datetime.now().isoformat(),
-                "first_transaction": None
-            }
-            
-            wallets.append(wallet)
-        
-        # If no wallets found through direct parsing, try extracting from script tags
-        if not wallets:
-            scripts = soup.find_all('script')
-            for script in scripts:
-                if script.string and 'wallets' in script.string:
-                    # Try to extract wallet data from JavaScript
-                    matches = re.findall(r'"address":"([^"]+)"', script.string)
-                    for address in matches:
-                        wallet = {
-                            "address": address,
-                            "chain": "unknown",
-                            "balance": 0,
-                            "label": "USG Wallet",
-                            "first_seen": datetime.now().isoformat(),
-                            "first_transaction": None
-                        }
-                        wallets.append(wallet)
-        
-        # Deduplicate wallets
-        unique_wallets = []
-        seen_addresses = set()
-        for wallet in wallets:
-            if wallet["address"] not in seen_addresses:
-                seen_addresses.add(wallet["address"])
-                unique_wallets.append(wallet)
-        
-        logger.info(f"Extracted {len(unique_wallets)} wallets from page")
-        return unique_wallets
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        return headers
 
 
 class WalletMonitor:
@@ -337,8 +660,11 @@ class WalletMonitor:
     def __init__(self):
         self.config = Config()
         self.db = Database()
-        self.api = ArkhamAPI(self.config)
+        self.api = ArkhamAPI(self.config, self.db)
         self.entity_id = self.config.get("MONITORING", "entity_id")
+        
+        # Addresses already confirmed to be in the database
+        self._known_addresses = set()
     
     def run(self):
         """Run the monitoring process"""
@@ -346,73 +672,71 @@ class WalletMonitor:
         
         # Get current data from API
         history_data = self.api.get_entity_history(self.entity_id)
-        portfolio_data = self.api.get_entity_portfolio(self.entity_id)
         
-        if not history_data and not portfolio_data:
+        # An unchanged page has nothing new to parse or store
+        if self.api.not_modified:
+            # The page matches one already processed, so its validators are safe to keep
+            self.api.mark_processed()
+            logger.info("Entity page unchanged, skipping processing")
+            return []
+        
+        if not history_data:
             logger.error("Failed to retrieve data from web scraping")
             return []
         
-        # Save API responses
-        if history_data:
-            self.db.save_api_response(f"/history/entity/{self.entity_id}", history_data)
+        # Process the data to find new wallets
+        new_wallets = self.process_data(history_data)
         
-        if portfolio_data and portfolio_data != history_data:
-            self.db.save_api_response(f"/portfolio/entity/{self.entity_id}", portfolio_data)
+        # Only skip this page in future cycles once its wallets are stored
+        self.api.mark_processed()
         
-        # Process the data to find new wallets
-        new_wallets = self.process_data(history_data, portfolio_data)
+        # Save API response, whose content hash lets a restarted monitor skip the same page
+        self.db.save_api_response(_history_endpoint(self.entity_id), history_data, self.api.content_hash)
         
         # Return the new wallets
         return new_wallets
     
-    def process_data(self, history_data, portfolio_data):
+    def process_data(self, data):
         """Process API data to identify new wallets"""
         logger.info("Processing data to identify new wallets")
         
-        # Get list of known wallet addresses
-        known_addresses = set(self.db.get_known_wallet_addresses())
+        # Gather candidate wallets from the scraped data
+        candidates = []
+        if data and 'data' in data and 'wallets' in data['data']:
+            candidates = [wallet for wallet in data['data']['wallets'] if 'address' in wallet]
+        
+        # Only addresses not seen in an earlier cycle need checking against the database
+        unchecked_addresses = {wallet['address'] for wallet in candidates} - self._known_addresses
+        unseen_addresses = set()
+        
+        if unchecked_addresses:
+            unseen_addresses = self.db.get_new_wallet_addresses(unchecked_addresses)
+            self._known_addresses |= unchecked_addresses - unseen_addresses
+        
         new_wallets = []
         
-        # Process wallets from history data
-        if history_data and 'data' in history_data and 'wallets' in history_data['data']:
-            for wallet in history_data['data']['wallets']:
-                if 'address' in wallet and wallet['address'] not in known_addresses:
-                    self._process_new_wallet(wallet, new_wallets, known_addresses)
+        for wallet in candidates:
+            if wallet['address'] in unseen_addresses:
+                self._process_new_wallet(wallet, new_wallets, unseen_addresses)
         
-        # Process wallets from portfolio data if different from history
-        if portfolio_data and portfolio_data != history_data and 'data' in portfolio_data and 'wallets' in portfolio_data['data']:
-            for wallet in portfolio_data['data']['wallets']:
-                if 'address' in wallet and wallet['address'] not in known_addresses:
-                    self._process_new_wallet(wallet, new_wallets, known_addresses)
+        # Save all new wallets in one transaction
+        if new_wallets:
+            self.db.save_wallets_bulk(new_wallets)
+            self._known_addresses.update(wallet['address'] for wallet in new_wallets)
         
         logger.info(f"Found {len(new_wallets)} new wallets")
         return new_wallets
     
-    def _process_new_wallet(self, wallet, new_wallets, known_addresses):
-        """Process a new wallet and add it to the database"""
+    def _process_new_wallet(self, wallet, new_wallets, unseen_addresses):
+        """Record a new wallet to be saved with the rest of the cycle's wallets"""
         address = wallet['address']
         chain = wallet.get('chain', 'unknown')
-        first_seen = wallet.get('first_seen', datetime.now().isoformat())
-        first_transaction = wallet.get('first_transaction')
-        label = wallet.get('label', 'USG Wallet')
-        balance = wallet.get('balance', 0)
         
         logger.info(f"New wallet detected: {address} ({chain})")
         
-        # Save to database
-        self.db.save_wallet(
-            address=address,
-            chain=chain,
-            first_seen=first_seen,
-            first_transaction=first_transaction,
-            label=label,
-            balance=balance,
-            raw_data=wallet
-        )
-        
-        # Add to new wallets list and known addresses set
+        # Add to new wallets list, and drop from the unseen set so duplicates are skipped
         new_wallets.append(wallet)
-        known_addresses.add(address)
+        unseen_addresses.discard(address)
 
 
 if __name__ == "__main__":